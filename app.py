@@ -1,8 +1,14 @@
 from flask import Flask, jsonify, request, send_from_directory
+from flask.json.provider import DefaultJSONProvider
+from collections import OrderedDict
+import gzip
+import hashlib
 import json
 import os
+import re
 from datetime import datetime
 import threading
+import time
 import urllib.request
 import urllib.parse
 import uuid
@@ -12,9 +18,32 @@ except ImportError:
     # Fallback nếu werkzeug không có
     def secure_filename(filename):
         return filename.replace(' ', '_').replace('/', '_')
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import DuplicateKeyError
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# --- JSON OUTPUT ---
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON gọn, giữ nguyên tiếng Việt (UTF-8 thay vì \\uXXXX), dùng orjson nếu có"""
+    ensure_ascii = False
+    compact = True
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        # orjson luôn compact + UTF-8; chỉ dùng khi không yêu cầu option khác
+        if orjson is not None and set(kwargs) <= {'separators'}:
+            return orjson.dumps(obj, default=self.default).decode('utf-8')
+        return super().dumps(obj, **kwargs)
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 DB_FILE = 'guestbook.json'
 
 # --- VERCEL DETECTION ---
@@ -41,6 +70,75 @@ except Exception as e:
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# --- RESPONSE COMPRESSION ---
+COMPRESS_MIN_SIZE = 1024  # bytes, response nhỏ hơn thì không nén
+COMPRESS_MIMETYPES = {'application/json', 'text/html', 'text/css', 'text/javascript', 'application/javascript'}
+COMPRESS_CACHE_BYTES = 8 * 1024 * 1024  # tổng dung lượng body đã nén được cache (LRU)
+COMPRESS_CACHE_MAX_BODY = 1024 * 1024  # body lớn hơn thì nén trực tiếp, không cache
+
+# (encoding, hash của body) -> body đã nén; response giống nhau không phải nén lại
+_compress_cache = OrderedDict()
+_compress_cache_bytes = 0
+_compress_lock = threading.Lock()
+
+def _pick_encoding():
+    accept = request.accept_encodings
+    if brotli is not None and accept['br']:
+        return 'br'
+    if accept['gzip']:
+        return 'gzip'
+    return None
+
+def _compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+def compress_body(body, encoding):
+    """Nén body, dùng lại kết quả đã cache nếu body không đổi"""
+    global _compress_cache_bytes
+    if len(body) > COMPRESS_CACHE_MAX_BODY:
+        return _compress(body, encoding)
+
+    key = (encoding, hashlib.blake2b(body, digest_size=16).digest())
+    with _compress_lock:
+        cached = _compress_cache.get(key)
+        if cached is not None:
+            _compress_cache.move_to_end(key)
+            return cached
+
+    compressed = _compress(body, encoding)
+
+    with _compress_lock:
+        if key not in _compress_cache:
+            _compress_cache[key] = compressed
+            _compress_cache_bytes += len(compressed)
+        while _compress_cache_bytes > COMPRESS_CACHE_BYTES:
+            _, evicted = _compress_cache.popitem(last=False)
+            _compress_cache_bytes -= len(evicted)
+    return compressed
+
+@app.after_request
+def compress_response(response):
+    """Nén gzip/brotli theo Accept-Encoding cho JSON/HTML đủ lớn"""
+    if (response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _pick_encoding()
+    if not encoding:
+        return response
+
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+
+    response.set_data(compress_body(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
 MONGO_URI = os.environ.get('MONGO_URI') # Get connection string from Environment
 
 # --- DATABASE ADAPTER ---
@@ -150,7 +248,7 @@ class LinkStore:
         return slug or 'link'
     
     def create(self, recipient_name, message, custom_slug=None, page_title=None, 
-                 sender_name=None, subtitle=None, og_image=None):
+                 sender_name=None, subtitle=None, og_image=None, template_id=None, variables=None):
         """Tạo link mới với Open Graph support"""
         slug = custom_slug.strip() if custom_slug else self._generate_slug(recipient_name)
         
@@ -173,6 +271,10 @@ class LinkStore:
             'og_image': og_image,  # Path to uploaded image
             'created_at': datetime.now().isoformat()
         }
+        # Link dùng template: chỉ lưu template id + biến, message được expand lúc render
+        if template_id:
+            link_data['template_id'] = template_id
+            link_data['variables'] = variables or {}
         
         if self.use_mongo:
             self.collection.insert_one(link_data.copy())
@@ -188,7 +290,7 @@ class LinkStore:
         """Cập nhật link đã tồn tại"""
         if self.use_mongo:
             # Chỉ update các field được phép
-            update_fields = {k: v for k, v in data.items() if k in ['recipient_name', 'sender_name', 'message', 'page_title', 'subtitle', 'og_image']}
+            update_fields = {k: v for k, v in data.items() if k in ['recipient_name', 'sender_name', 'message', 'page_title', 'subtitle', 'og_image', 'template_id', 'variables']}
             result = self.collection.update_one({'slug': slug}, {'$set': update_fields})
             return result.modified_count > 0 or result.matched_count > 0
         else:
@@ -202,6 +304,8 @@ class LinkStore:
                     if 'page_title' in data: link['page_title'] = data['page_title']
                     if 'subtitle' in data: link['subtitle'] = data['subtitle']
                     if 'og_image' in data: link['og_image'] = data['og_image']
+                    if 'template_id' in data: link['template_id'] = data['template_id']
+                    if 'variables' in data: link['variables'] = data['variables']
                     
                     with open(self.local_file, 'w', encoding='utf-8') as f:
                         json.dump(links, f, ensure_ascii=False, indent=2)
@@ -246,9 +350,52 @@ class LinkStore:
                 return True
             return False
 
+    def inline_template(self, template_id, expand):
+        """Ghi lời chúc đã expand vào các link đang dùng template (trước khi xóa template)"""
+        if self.use_mongo:
+            ops = [
+                UpdateOne({'_id': link['_id']},
+                          {'$set': {'message': expand(link)}, '$unset': {'template_id': '', 'variables': ''}})
+                for link in self.collection.find({'template_id': template_id})
+            ]
+            if ops:
+                self.collection.bulk_write(ops, ordered=False)
+            return len(ops)
+        else:
+            links = self.get_all()
+            count = 0
+            for link in links:
+                if link.get('template_id') == template_id:
+                    link['message'] = expand(link)
+                    link.pop('template_id', None)
+                    link.pop('variables', None)
+                    count += 1
+            if count:
+                with open(self.local_file, 'w', encoding='utf-8') as f:
+                    json.dump(links, f, ensure_ascii=False, indent=2)
+            return count
+
 link_store = LinkStore()
 
 # --- TEMPLATE STORE (Message Templates) ---
+# Placeholder dạng {recipient}, {sender}, {class}...
+PLACEHOLDER_RE = re.compile(r'\{(\w+)\}')
+
+def compile_template(content):
+    """Tách template thành tuple (text, tên biến, text, tên biến, ..., text)"""
+    return tuple(PLACEHOLDER_RE.split(content))
+
+def expand_template(parts, variables):
+    """Render template đã compile; placeholder không có giá trị thành chuỗi rỗng"""
+    out = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            value = variables.get(part)
+            out.append('' if value is None else str(value))
+        else:
+            out.append(part)
+    return ''.join(out)
+
 class TemplateStore:
     """Quản lý các template lời chúc tùy chỉnh"""
     def __init__(self):
@@ -266,58 +413,159 @@ class TemplateStore:
                     database = client.get_default_database()
                 
                 self.collection = database['message_templates']
+                # Index cho lookup theo id (render/update/delete)
+                self.collection.create_index('id', unique=True, sparse=True)
                 self.use_mongo = True
             except Exception as e:
                 print(f"!! TemplateStore MongoDB Failed: {e}")
-    
+
+        # JSON backend: cache nội dung file + index theo name/id, reload khi file thay đổi
+        self._local_stamp = None
+        self._local_data = []
+        self._by_id = {}
+        # Template đã compile: id -> (content, parts)
+        self._compiled = {}
+
+        try:
+            self._backfill_ids()
+        except Exception as e:
+            print(f"!! TemplateStore backfill id failed: {e}")
+
+    @staticmethod
+    def _legacy_id(template):
+        # Id suy ra từ nội dung: các worker backfill song song đều ra cùng một id
+        raw = f"{template.get('name')}|{template.get('content')}|{template.get('created_at')}"
+        return hashlib.blake2b(raw.encode('utf-8'), digest_size=6).hexdigest()
+
+    def _backfill_ids(self):
+        """Gán id cho template cũ (tạo trước khi có id) để sửa/xóa theo id"""
+        if self.use_mongo:
+            for t in self.collection.find({'id': {'$exists': False}}):
+                # Chỉ ghi nếu chưa worker nào gán id
+                guard = {'_id': t['_id'], 'id': {'$exists': False}}
+                try:
+                    self.collection.update_one(guard, {'$set': {'id': self._legacy_id(t)}})
+                except DuplicateKeyError:
+                    # Template cũ trùng hệt nhau -> id suy ra bị trùng, dùng id ngẫu nhiên
+                    self.collection.update_one(guard, {'$set': {'id': uuid.uuid4().hex[:12]}})
+        else:
+            data = self._load_local()
+            missing = [t for t in data if not t.get('id')]
+            if missing:
+                for t in missing:
+                    t['id'] = self._legacy_id(t)
+                self._save_local(data)
+
+    def _load_local(self):
+        """Đọc file JSON (chỉ khi file thay đổi) và build index"""
+        try:
+            st = os.stat(self.local_file)
+            stamp = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        if stamp == self._local_stamp:
+            return self._local_data
+
+        data = []
+        if stamp is not None:
+            try:
+                with open(self.local_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except:
+                data = []
+        self._index_local(data, stamp)
+        return data
+
+    def _index_local(self, data, stamp):
+        self._by_id = {t['id']: t for t in data if t.get('id')}
+        self._local_data = data
+        self._local_stamp = stamp
+
+    def _save_local(self, data):
+        with open(self.local_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        st = os.stat(self.local_file)
+        self._index_local(data, (st.st_mtime_ns, st.st_size))
+
     def create(self, name, content):
         """Tạo template mới"""
         template_data = {
+            'id': uuid.uuid4().hex[:12],
             'name': name,
             'content': content,
             'created_at': datetime.now().isoformat()
         }
-        
+
         if self.use_mongo:
             self.collection.insert_one(template_data.copy())
         else:
-            data = self.get_all()
+            data = list(self._load_local())
             data.insert(0, template_data)
-            with open(self.local_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        
+            self._save_local(data)
+
         return template_data
-    
+
+    def update(self, template_id, data):
+        """Cập nhật template (một lần ghi, áp dụng cho mọi link dùng template này)"""
+        update_fields = {k: v for k, v in data.items() if k in ['name', 'content']}
+        self._compiled.pop(template_id, None)
+        if self.use_mongo:
+            result = self.collection.update_one({'id': template_id}, {'$set': update_fields})
+            return result.matched_count > 0
+        else:
+            self._load_local()
+            template = self._by_id.get(template_id)
+            if not template:
+                return False
+            template.update(update_fields)
+            self._save_local(self._local_data)
+            return True
+
     def get_all(self):
         """Lấy tất cả templates"""
         if self.use_mongo:
             cursor = self.collection.find({}, {'_id': 0}).sort('_id', -1)
             return list(cursor)
         else:
-            if not os.path.exists(self.local_file):
-                return []
-            try:
-                with open(self.local_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except:
-                return []
-    
-    def delete(self, name):
-        """Xóa template theo tên"""
+            return list(self._load_local())
+
+    def get_by_id(self, template_id):
+        """Lấy template theo id"""
         if self.use_mongo:
-            result = self.collection.delete_one({'name': name})
+            return self.collection.find_one({'id': template_id}, {'_id': 0})
+        else:
+            self._load_local()
+            return self._by_id.get(template_id)
+
+    def delete(self, template_id):
+        """Xóa template theo id"""
+        self._compiled.pop(template_id, None)
+        if self.use_mongo:
+            result = self.collection.delete_one({'id': template_id})
             return result.deleted_count > 0
         else:
-            data = self.get_all()
-            new_data = [t for t in data if t.get('name') != name]
-            if len(new_data) < len(data):
-                with open(self.local_file, 'w', encoding='utf-8') as f:
-                    json.dump(new_data, f, ensure_ascii=False, indent=2)
-                return True
-            return False
+            self._load_local()
+            if template_id not in self._by_id:
+                return False
+            self._save_local([t for t in self._local_data if t.get('id') != template_id])
+            return True
+
+    def render(self, template_id, variables):
+        """Expand template với biến; trả về None nếu template không tồn tại"""
+        template = self.get_by_id(template_id)
+        if not template:
+            return None
+        content = template.get('content', '')
+        compiled = self._compiled.get(template_id)
+        # So sánh content để nhận ra thay đổi từ worker/process khác
+        if compiled is None or compiled[0] != content:
+            compiled = (content, compile_template(content))
+            self._compiled[template_id] = compiled
+        return expand_template(compiled[1], variables)
 
 template_store = TemplateStore()
 
+DISCORD_TIMEOUT = 10  # seconds
 DISCORD_WEBHOOK_URL = "https://discord.com/api/webhooks/1461950574827278408/I2_yuUEogKPtxHnNAKF46tqPQF_PtT2salGtcBqA6QKoQL7TPGaLK7vdBMVD5FD1tPoX"
 
 def send_discord_notification(name, msg, is_public=True):
@@ -345,11 +593,48 @@ def send_discord_notification(name, msg, is_public=True):
             data=json.dumps(payload).encode('utf-8'),
             headers={'User-Agent': 'Mozilla/5.0', 'Content-Type': 'application/json'}
         )
-        with urllib.request.urlopen(req) as response:
+        with urllib.request.urlopen(req, timeout=DISCORD_TIMEOUT) as response:
             pass # Success
     except Exception as e:
         print(f"Failed to send Discord webhook: {e}")
 
+# --- BACKGROUND TASKS ---
+# Theo dõi các thread gửi Discord đang chạy để có thể drain khi shutdown (xem serve.py)
+_pending_lock = threading.Lock()
+_pending_threads = set()
+
+def _run_tracked(target, args):
+    try:
+        target(*args)
+    finally:
+        with _pending_lock:
+            _pending_threads.discard(threading.current_thread())
+
+def notify_async(name, msg, is_public=True):
+    """Gửi Discord notification trong background thread"""
+    thread = threading.Thread(target=_run_tracked, args=(send_discord_notification, (name, msg, is_public)))
+    with _pending_lock:
+        _pending_threads.add(thread)
+    try:
+        thread.start()
+    except Exception:
+        with _pending_lock:
+            _pending_threads.discard(thread)
+        raise
+    return thread
+
+def drain_pending(timeout=DISCORD_TIMEOUT):
+    """Chờ các notification còn đang gửi hoàn tất trước khi worker thoát"""
+    with _pending_lock:
+        threads = list(_pending_threads)
+    if threads:
+        print(f">> Draining {len(threads)} pending notification(s)...")
+    deadline = time.monotonic() + timeout
+    for thread in threads:
+        thread.join(max(0, deadline - time.monotonic()))
+    with _pending_lock:
+        return len(_pending_threads)
+
 
 GEN_Z_MESSAGES = [
     {"name": "Thảo_Mai_Pro", "msg": "Mãi keo lì nha các bạn iu <3 Ra trường đừng quên tao đấy!", "time": "Just now"},
@@ -384,6 +669,10 @@ def seed_data():
         return jsonify({"error": str(e)}), 500
 
 # --- PERSONALIZED LINKS API ---
+def clean_variables(variables):
+    """Bỏ biến rỗng, không lưu vào link (khi render sẽ thành chuỗi rỗng)"""
+    return {k: v for k, v in variables.items() if v is not None and str(v).strip() != ''}
+
 @app.route('/api/links', methods=['GET'])
 def get_links():
     """Lấy danh sách tất cả links"""
@@ -405,10 +694,17 @@ def create_link():
         sender_name = data.get('sender_name', '').strip()
         subtitle = data.get('subtitle', '').strip()
         og_image = data.get('og_image', '').strip()
+        template_id = (data.get('template_id') or '').strip()
+        variables = data.get('variables') or {}
         
         if not recipient_name:
             return jsonify({"error": "Tên người nhận không được để trống"}), 400
-        if not message:
+        if template_id and not template_store.get_by_id(template_id):
+            return jsonify({"error": "Template không tồn tại"}), 400
+        if not isinstance(variables, dict):
+            return jsonify({"error": "variables phải là object"}), 400
+        variables = clean_variables(variables)
+        if not message and not template_id:
             return jsonify({"error": "Lời chúc không được để trống"}), 400
         
         link = link_store.create(
@@ -418,7 +714,9 @@ def create_link():
             page_title or None,
             sender_name or None,
             subtitle or None,
-            og_image or None
+            og_image or None,
+            template_id or None,
+            variables
         )
         return jsonify({"status": "success", "link": link})
     except Exception as e:
@@ -429,6 +727,18 @@ def update_link(slug):
     """Cập nhật link đã tồn tại"""
     try:
         data = request.json
+        if 'variables' in data:
+            if not isinstance(data['variables'], dict):
+                return jsonify({"error": "variables phải là object"}), 400
+            data['variables'] = clean_variables(data['variables'])
+        if 'template_id' in data:
+            template_id = data['template_id'] or ''
+            if not isinstance(template_id, str):
+                return jsonify({"error": "template_id phải là chuỗi"}), 400
+            template_id = template_id.strip()
+            if template_id and not template_store.get_by_id(template_id):
+                return jsonify({"error": "Template không tồn tại"}), 400
+            data['template_id'] = template_id or None
         success = link_store.update(slug, data)
         if success:
             return jsonify({"status": "success", "slug": slug})
@@ -531,17 +841,41 @@ def create_template():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/templates/<name>', methods=['DELETE'])
-def delete_template(name):
-    """Xóa template"""
+@app.route('/api/templates/<template_id>', methods=['PUT'])
+def update_template(template_id):
+    """Sửa template (mọi link dùng template sẽ hiển thị nội dung mới)"""
     try:
-        success = template_store.delete(name)
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "Body phải là JSON object"}), 400
+        fields = {k: data[k] for k in ('name', 'content') if k in data}
+        if any(not isinstance(v, str) for v in fields.values()):
+            return jsonify({"error": "name/content phải là chuỗi"}), 400
+        fields = {k: v.strip() for k, v in fields.items()}
+        if 'name' in fields and not fields['name']:
+            return jsonify({"error": "Tên template không được để trống"}), 400
+        if 'content' in fields and not fields['content']:
+            return jsonify({"error": "Nội dung template không được để trống"}), 400
+        
+        success = template_store.update(template_id, fields)
         if success:
-            return jsonify({"status": "deleted"})
+            return jsonify({"status": "success", "id": template_id})
         return jsonify({"error": "Template không tồn tại"}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/templates/<template_id>', methods=['DELETE'])
+def delete_template(template_id):
+    """Xóa template (các link đang dùng được giữ lại lời chúc đã expand)"""
+    try:
+        if not template_store.get_by_id(template_id):
+            return jsonify({"error": "Template không tồn tại"}), 404
+        inlined = link_store.inline_template(template_id, render_link_message)
+        template_store.delete(template_id)
+        return jsonify({"status": "deleted", "links_updated": inlined})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 # --- ADMIN PANEL ---
 @app.route('/admin')
 def admin_panel():
@@ -549,6 +883,20 @@ def admin_panel():
     return send_from_directory('.', 'admin.html')
 
 # --- PERSONALIZED PAGE ---
+def render_link_message(link):
+    """Lời chúc của link: expand template (nếu có), fallback về message lưu sẵn"""
+    template_id = link.get('template_id')
+    if template_id:
+        variables = {
+            'recipient': link.get('recipient_name', ''),
+            'sender': link.get('sender_name', 'Bạn bè'),
+        }
+        variables.update(link.get('variables') or {})
+        message = template_store.render(template_id, variables)
+        if message is not None:
+            return message
+    return link.get('message') or ''
+
 @app.route('/p/<slug>')
 def personalized_page(slug):
     """Hiển thị trang thiệp mời cá nhân hóa với Open Graph"""
@@ -597,6 +945,9 @@ def personalized_page(slug):
         # Full URL của trang
         og_url = f"{base_url}/p/{slug}"
 
+        # Lời chúc (escape cho JS string)
+        message_js = render_link_message(link).replace('"', '\\"').replace('\n', '\\n').replace('\r', '')
+
         # Clean old tags: Replace everything between default markers
         start_marker = '<!-- Default Open Graph / Facebook / Messenger -->'
         end_marker = '<!-- Tailwind CSS -->'
@@ -634,7 +985,7 @@ def personalized_page(slug):
         window.PERSONALIZED_DATA = {{
             recipientName: "{link['recipient_name']}",
             senderName: "{link.get('sender_name', 'Bạn bè')}",
-            message: "{link['message'].replace('"', '\\"').replace(chr(10), '\\n').replace(chr(13), '')}",
+            message: "{message_js}",
             pageTitle: "{link['page_title']}",
             subtitle: "{link.get('subtitle', '').replace('"', '\\"')}"
         }};
@@ -716,7 +1067,7 @@ def add_message():
             
         # Send Discord Notification (Async)
         try:
-            threading.Thread(target=send_discord_notification, args=(new_msg.get('name'), new_msg.get('msg'), new_msg.get('is_public', True))).start()
+            notify_async(new_msg.get('name'), new_msg.get('msg'), new_msg.get('is_public', True))
         except Exception as e:
             print(f"Thread error: {e}")
 
@@ -725,5 +1076,6 @@ def add_message():
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
-    print(">> YEARBOOK SYSTEM ONLINE: http://localhost:5000")
-    app.run(debug=True, port=1000)
+    # Dev server only - production dùng `python serve.py` (Gunicorn)
+    print(">> YEARBOOK SYSTEM ONLINE: http://localhost:1000")
+    app.run(debug=os.environ.get('FLASK_DEBUG', '1') == '1', port=1000)
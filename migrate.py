@@ -0,0 +1,522 @@
+"""Migrate và kiểm tra dữ liệu giữa JSON files và MongoDB.
+
+    python migrate.py copy --from json --to mongo            # đẩy dữ liệu local lên Atlas
+    python migrate.py copy --from mongo --to json --resume   # tiếp tục lần chạy bị ngắt
+    python migrate.py verify                                  # so sánh count + hash từng collection
+
+copy là merge theo key ở cả 2 chiều: trùng key thì bản ở nguồn thắng, record chỉ có ở đích
+được giữ lại. Cần biến môi trường MONGO_URI (giống app.py).
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import textwrap
+import time
+import urllib.parse
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import InsertOne, MongoClient, ReplaceOne
+
+# name -> (file JSON, collection Mongo, field dùng làm key, indent của file)
+# key là danh sách field thử lần lượt; rỗng = record được nhận diện bằng (nội dung, lần xuất hiện thứ mấy)
+COLLECTIONS = {
+    'guestbook': {'file': 'guestbook.json', 'collection': 'guestbook', 'key': (), 'indent': 4},
+    'links': {'file': 'personalized_links.json', 'collection': 'personalized_links', 'key': ('slug',), 'indent': 2},
+    # Template cũ chưa có id thì dùng name
+    'templates': {'file': 'message_templates.json', 'collection': 'message_templates', 'key': ('id', 'name'), 'indent': 2},
+}
+
+BACKENDS = ('json', 'mongo')
+CHECKPOINT_FILE = '.migrate_checkpoint.json'
+VERIFY_BUCKETS = 256
+VERIFY_MAX_KEYS = 20000  # số key tối đa giữ trong RAM mỗi lượt đọc chi tiết khi verify
+HASH_MOD = 1 << 128
+
+
+# --- MONGO ---
+def get_database(uri):
+    client = MongoClient(uri)
+    # Cùng logic chọn database với app.py
+    db_name = urllib.parse.urlparse(uri).path.strip('/')
+    if not db_name:
+        return client['yearbook_2026']
+    return client.get_default_database()
+
+def record_timestamp(doc):
+    """Thời điểm tạo record: created_at (links, templates) hoặc ngày trong field time (guestbook, %d/%m/%Y)"""
+    try:
+        if doc.get('created_at'):
+            return int(datetime.fromisoformat(doc['created_at']).timestamp())
+        if doc.get('time'):
+            return int(datetime.strptime(doc['time'], "%d/%m/%Y").timestamp())
+    except (TypeError, ValueError, OverflowError):
+        pass
+    return None
+
+def fallback_timestamp(collection):
+    """Timestamp cho record không rõ thời điểm tạo: cũ hơn record cũ nhất đang có trong Mongo.
+
+    Tránh để record merge vào xếp trên các record sẵn có (app chỉ giữ 100 _id mới nhất của guestbook).
+    """
+    oldest = collection.find_one({}, {'_id': 1}, sort=[('_id', 1)])
+    if oldest and isinstance(oldest['_id'], ObjectId):
+        return max(int(oldest['_id'].generation_time.timestamp()) - 1, 0)
+    return int(time.time())
+
+def ordered_object_id(doc, index, fallback_ts):
+    """_id tăng theo thời điểm tạo, cùng thời điểm thì record đứng trước trong file (mới hơn) có _id lớn hơn.
+
+    App sort theo _id giảm dần, nên thứ tự hiển thị sau khi migrate giữ nguyên như file JSON.
+    """
+    ts = record_timestamp(doc)
+    if ts is None or not 0 <= ts < (1 << 32):
+        ts = fallback_ts
+    return ObjectId(ts.to_bytes(4, 'big') + ((1 << 63) - index).to_bytes(8, 'big'))
+
+
+# --- JSON ---
+def iter_json_array(path, chunk_size=1 << 16):
+    """Đọc từng phần tử của file JSON array mà không load cả file vào RAM"""
+    if not os.path.exists(path):
+        return
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buf, pos = '', 0
+        started = False
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buf):
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                buf, pos = chunk, 0
+                continue
+
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError(f"{path}: không phải JSON array")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Record bị cắt ngang giữa 2 chunk -> đọc thêm rồi parse lại
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            yield obj
+            pos = end
+
+class JsonArrayWriter:
+    """Ghi JSON array từng record vào file tạm (cùng format json.dump của app), replace khi xong"""
+    def __init__(self, path, indent, resume_pos=None):
+        self.path = path
+        self.tmp_path = path + '.migrate.tmp'
+        self.indent = indent
+        if resume_pos is not None and os.path.exists(self.tmp_path):
+            self.f = open(self.tmp_path, 'r+b')
+            self.f.truncate(resume_pos)
+            self.f.seek(resume_pos)
+            self.empty = resume_pos == 0
+        else:
+            self.f = open(self.tmp_path, 'wb')
+            self.empty = True
+
+    def write(self, doc):
+        text = json.dumps(doc, ensure_ascii=False, indent=self.indent)
+        prefix = '[\n' if self.empty else ',\n'
+        self.f.write((prefix + textwrap.indent(text, ' ' * self.indent)).encode('utf-8'))
+        self.empty = False
+
+    def flush(self):
+        """Flush xuống đĩa, trả về vị trí để lưu checkpoint"""
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return self.f.tell()
+
+    def close(self):
+        self.f.write(b'[]' if self.empty else b'\n]')
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+
+
+# --- CHECKPOINT ---
+class Checkpoint:
+    """Lưu tiến độ từng collection để resume sau khi bị ngắt"""
+    def __init__(self, path, run_key, resume):
+        self.path = path
+        self.run_key = run_key
+        self.state = {}
+        if resume and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f).get(run_key, {})
+
+    def get(self, name):
+        return self.state.get(name)
+
+    def save(self, name, progress):
+        self.state[name] = progress
+        self._write()
+
+    def clear(self, name):
+        self.state.pop(name, None)
+        self._write()
+
+    def _write(self):
+        data = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        if self.state:
+            data[self.run_key] = self.state
+        else:
+            data.pop(self.run_key, None)
+        if not data:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+# --- COPY ---
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def record_digest(doc):
+    """Hash nội dung record, không phụ thuộc thứ tự field và bỏ qua _id"""
+    body = {k: v for k, v in doc.items() if k != '_id'}
+    canonical = json.dumps(body, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).digest()
+
+def record_filter(spec, doc):
+    """Filter để upsert idempotent theo key (None nếu collection không có key)"""
+    for field in spec['key']:
+        if doc.get(field):
+            return {field: doc[field]}
+    return None
+
+def existing_ids(collection, spec, batch):
+    """(field, value) -> _id của các record có key trong batch đã tồn tại trong Mongo"""
+    values = {}
+    for doc, _, _ in batch:
+        key_filter = record_filter(spec, doc)
+        if key_filter:
+            (field, value), = key_filter.items()
+            values.setdefault(field, []).append(value)
+    found = {}
+    for field, vals in values.items():
+        for d in collection.find({field: {'$in': vals}}, {field: 1}):
+            found[(field, d.get(field))] = d['_id']
+    return found
+
+def mongo_copies(collection, doc, digest):
+    """Số record trong Mongo có nội dung giống hệt doc"""
+    content = {k: v for k, v in doc.items() if k != '_id'}
+    return sum(1 for d in collection.find(content) if record_digest(d) == digest)
+
+def iter_json_source(path, spec, skip=0):
+    """Yield (doc, index, occurrence) từ file JSON, bỏ qua `skip` record đầu.
+
+    occurrence = record giống hệt này đã xuất hiện bao nhiêu lần trước đó (chỉ tính cho
+    record không có key, tức guestbook - app giới hạn 100 record nên dict này nhỏ).
+    """
+    seen = {}
+    for index, doc in enumerate(iter_json_array(path)):
+        occ = 0
+        if not record_filter(spec, doc):
+            # Vẫn đếm cho phần đã skip để resume nhận diện đúng record trùng
+            digest = record_digest(doc)
+            occ = seen.get(digest, 0)
+            seen[digest] = occ + 1
+        if index >= skip:
+            yield doc, index, occ
+
+def missing_in_mongo(collection, spec, batch, existing):
+    """Lọc các (doc, _, occurrence) trong batch mà Mongo chưa có.
+
+    Có key: so theo key (1 query $in mỗi field). Không có key: bản thứ occ được coi là
+    chưa có nếu Mongo có ít hơn occ+1 bản giống hệt; existing cache digest -> count.
+    """
+    present = existing_ids(collection, spec, batch)
+
+    missing = []
+    for item in batch:
+        doc, _, occ = item
+        key_filter = record_filter(spec, doc)
+        if key_filter:
+            if next(iter(key_filter.items())) not in present:
+                missing.append(item)
+            continue
+        digest = record_digest(doc)
+        if digest not in existing:
+            existing[digest] = mongo_copies(collection, doc, digest)
+        if occ >= existing[digest]:
+            missing.append(item)
+    return missing
+
+def iter_source(args, spec, progress):
+    """Yield (doc, cursor_id, occurrence) từ backend nguồn, bỏ qua phần đã xong theo checkpoint"""
+    if args.source == 'json':
+        skip = progress['done'] if progress else 0
+        yield from iter_json_source(os.path.join(args.data_dir, spec['file']), spec, skip)
+    else:
+        query = {}
+        if progress and progress.get('last_id'):
+            # Đọc newest-first, resume từ sau _id cuối cùng đã copy
+            query = {'_id': {'$lt': ObjectId(progress['last_id'])}}
+        cursor = args.db[spec['collection']].find(query).sort('_id', -1).batch_size(args.batch_size)
+        for doc in cursor:
+            cursor_id = doc.pop('_id')
+            yield doc, cursor_id, 0
+
+def copy_collection(args, name, checkpoint):
+    spec = COLLECTIONS[name]
+    progress = checkpoint.get(name)
+    done = progress['done'] if progress else 0
+    if progress:
+        print(f">> {name}: resuming after {done} records")
+
+    writer = None
+    collection = None
+    use_insert = False
+    if args.target == 'json':
+        writer = JsonArrayWriter(os.path.join(args.data_dir, spec['file']), spec['indent'],
+                                 progress.get('tmp_pos') if progress else None)
+    else:
+        collection = args.db[spec['collection']]
+        # Collection đích rỗng và chạy mới: insert_many nhanh hơn; còn lại dùng bulk upsert
+        use_insert = not progress and collection.estimated_document_count() == 0
+
+    fallback_ts = fallback_timestamp(collection) if collection is not None else int(time.time())
+    # Record không có key: số bản giống hệt đã có trong Mongo trước khi ghi (digest -> count)
+    existing = {}
+    started = time.monotonic()
+    # Checkpoint ở phase 'json' nghĩa là đã copy xong phần từ Mongo
+    source = [] if progress and progress.get('phase') == 'json' else iter_source(args, spec, progress)
+    for batch in batched(source, args.batch_size):
+        if writer:
+            for doc, _, _ in batch:
+                writer.write(doc)
+            state = {'done': done + len(batch), 'tmp_pos': writer.flush()}
+        else:
+            docs = []
+            for doc, cursor_id, _ in batch:
+                doc['_id'] = ordered_object_id(doc, cursor_id, fallback_ts)
+                docs.append(doc)
+            if use_insert:
+                collection.insert_many(docs, ordered=False)
+            else:
+                ops = []
+                # Trùng key: thay cả document (field chỉ có ở Mongo bị xoá), giữ _id cũ vì _id không đổi được
+                ids = existing_ids(collection, spec, batch)
+                for doc, _, _ in batch:
+                    key_filter = record_filter(spec, doc)
+                    if key_filter:
+                        doc['_id'] = ids.get(next(iter(key_filter.items())), doc['_id'])
+                        ops.append(ReplaceOne(key_filter, doc, upsert=True))
+                # Không có key: chỉ ghi các bản Mongo chưa có
+                keyless = [item for item in batch if not record_filter(spec, item[0])]
+                for doc, _, _ in missing_in_mongo(collection, spec, keyless, existing):
+                    ops.append(InsertOne(doc))
+                if ops:
+                    collection.bulk_write(ops, ordered=False)
+            state = {'done': done + len(batch)}
+
+        if args.source == 'mongo':
+            state['last_id'] = str(batch[-1][1])
+        done = state['done']
+        checkpoint.save(name, state)
+        print(f">> {name}: {done} records")
+
+    kept = 0
+    if writer:
+        kept = keep_json_only(args, name, spec, writer, checkpoint, progress, done)
+        writer.close()
+    checkpoint.clear(name)
+    print(f">> {name}: copied {done} records {args.source} -> {args.target} in {time.monotonic() - started:.1f}s")
+    if kept:
+        print(f">> {name}: kept {kept} records only in json")
+
+def keep_json_only(args, name, spec, writer, checkpoint, progress, done):
+    """Mongo -> JSON phase 2: nối thêm các record chỉ có trong file JSON hiện tại (chưa bị replace)"""
+    collection = args.db[spec['collection']]
+    resumed = progress and progress.get('phase') == 'json'
+    json_done = progress['json_done'] if resumed else 0
+    kept = progress['kept'] if resumed else 0
+    existing = {}
+    source = iter_json_source(os.path.join(args.data_dir, spec['file']), spec, json_done)
+    for batch in batched(source, args.batch_size):
+        for doc, _, _ in missing_in_mongo(collection, spec, batch, existing):
+            writer.write(doc)
+            kept += 1
+        json_done += len(batch)
+        checkpoint.save(name, {'phase': 'json', 'done': done, 'json_done': json_done,
+                               'kept': kept, 'tmp_pos': writer.flush()})
+    return kept
+
+def cmd_copy(args):
+    if args.source == args.target:
+        sys.exit("!! --from và --to phải khác nhau")
+    run_key = f"{args.source}->{args.target}"
+    checkpoint = Checkpoint(os.path.join(args.data_dir, args.checkpoint), run_key, args.resume)
+    for name in args.collections:
+        copy_collection(args, name, checkpoint)
+
+
+# --- VERIFY ---
+def record_identity(spec, doc):
+    """(key, digest) của record"""
+    digest = record_digest(doc)
+    key_filter = record_filter(spec, doc)
+    if key_filter:
+        (field, value), = key_filter.items()
+        return f"{field}={value}", digest
+    # Không có key: chính nội dung là key
+    return f"name={doc.get('name', '')}#{digest.hex()[:8]}", digest
+
+def bucket_of(key):
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=2).digest()[0] % VERIFY_BUCKETS
+
+def iter_records(args, backend, spec):
+    if backend == 'json':
+        return iter_json_array(os.path.join(args.data_dir, spec['file']))
+    return args.db[spec['collection']].find({}, {'_id': 0}).batch_size(args.batch_size)
+
+def summarize(records, spec):
+    """Count + tổng digest theo bucket (không phụ thuộc thứ tự, bộ nhớ cố định)"""
+    counts = [0] * VERIFY_BUCKETS
+    sums = [0] * VERIFY_BUCKETS
+    for doc in records:
+        key, digest = record_identity(spec, doc)
+        b = bucket_of(key)
+        counts[b] += 1
+        sums[b] = (sums[b] + int.from_bytes(digest, 'big')) % HASH_MOD
+    return counts, sums
+
+def collect_buckets(records, spec, buckets):
+    """key -> danh sách digest, chỉ cho các bucket lệch"""
+    found = {}
+    for doc in records:
+        key, digest = record_identity(spec, doc)
+        if bucket_of(key) in buckets:
+            found.setdefault(key, []).append(digest)
+    return found
+
+def diff_buckets(args, spec, buckets):
+    """Liệt kê key khác nhau giữa 2 backend trong các bucket cho trước"""
+    in_json = collect_buckets(iter_records(args, 'json', spec), spec, buckets)
+    in_mongo = collect_buckets(iter_records(args, 'mongo', spec), spec, buckets)
+    diffs = []
+    for key in sorted(set(in_json) | set(in_mongo)):
+        a, b = sorted(in_json.get(key, [])), sorted(in_mongo.get(key, []))
+        if a == b:
+            continue
+        if not b:
+            diffs.append(f"only in json: {key}")
+        elif not a:
+            diffs.append(f"only in mongo: {key}")
+        elif len(a) != len(b):
+            diffs.append(f"duplicate count differs ({len(a)} json / {len(b)} mongo): {key}")
+        else:
+            diffs.append(f"content differs: {key}")
+    return diffs
+
+def summary_hash(sums):
+    return hashlib.sha256(b''.join(s.to_bytes(16, 'big') for s in sums)).hexdigest()[:16]
+
+def verify_collection(args, name):
+    spec = COLLECTIONS[name]
+    json_counts, json_sums = summarize(iter_records(args, 'json', spec), spec)
+    mongo_counts, mongo_sums = summarize(iter_records(args, 'mongo', spec), spec)
+
+    ok = json_counts == mongo_counts and json_sums == mongo_sums
+    print(f">> {name}: json={sum(json_counts)} ({summary_hash(json_sums)}) "
+          f"mongo={sum(mongo_counts)} ({summary_hash(mongo_sums)}) -> {'OK' if ok else 'MISMATCH'}")
+    if ok:
+        return True
+
+    # Lượt 2: đọc chi tiết các bucket lệch theo nhóm (mỗi nhóm <= VERIFY_MAX_KEYS record),
+    # dừng khi đã đủ max_diffs khác biệt
+    groups, group, group_size = [], [], 0
+    for b in range(VERIFY_BUCKETS):
+        if json_counts[b] == mongo_counts[b] and json_sums[b] == mongo_sums[b]:
+            continue
+        size = max(json_counts[b], mongo_counts[b])
+        if group and group_size + size > VERIFY_MAX_KEYS:
+            groups.append(group)
+            group, group_size = [], 0
+        group.append(b)
+        group_size += size
+    groups.append(group)
+
+    diffs, unchecked = [], 0
+    for i, group in enumerate(groups):
+        if len(diffs) >= args.max_diffs:
+            unchecked = sum(len(g) for g in groups[i:])
+            break
+        diffs.extend(diff_buckets(args, spec, set(group)))
+
+    for line in diffs[:args.max_diffs]:
+        print(f"   - {line}")
+    if len(diffs) > args.max_diffs:
+        print(f"   ... and {len(diffs) - args.max_diffs} more")
+    if unchecked:
+        print(f"   ... and more differences in {unchecked} unchecked buckets")
+    return False
+
+def cmd_verify(args):
+    results = [verify_collection(args, name) for name in args.collections]
+    if not all(results):
+        sys.exit(1)
+
+
+def parse_args(argv=None):
+    # Option chung đặt sau subcommand (--collections nhận nhiều giá trị nên không đặt trước được)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--data-dir', default='.', help='Thư mục chứa các file JSON')
+    common.add_argument('--collections', nargs='+', choices=list(COLLECTIONS), default=list(COLLECTIONS))
+    common.add_argument('--batch-size', type=int, default=1000)
+
+    parser = argparse.ArgumentParser(description='Migrate/verify dữ liệu giữa JSON files và MongoDB')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    copy = sub.add_parser('copy', parents=[common], help='Merge dữ liệu giữa 2 backend (upsert, có checkpoint)')
+    copy.add_argument('--from', dest='source', choices=BACKENDS, required=True)
+    copy.add_argument('--to', dest='target', choices=BACKENDS, required=True)
+    copy.add_argument('--resume', action='store_true', help='Tiếp tục từ checkpoint của lần chạy trước')
+    copy.add_argument('--checkpoint', default=CHECKPOINT_FILE)
+    copy.set_defaults(func=cmd_copy)
+
+    verify = sub.add_parser('verify', parents=[common], help='So sánh count + content hash giữa 2 backend')
+    verify.add_argument('--max-diffs', type=int, default=20)
+    verify.set_defaults(func=cmd_verify)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    uri = os.environ.get('MONGO_URI')
+    if not uri:
+        sys.exit("!! Cần đặt MONGO_URI để kết nối MongoDB")
+    args.db = get_database(uri)
+    args.func(args)
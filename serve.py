@@ -0,0 +1,115 @@
+"""Production launcher cho Yearbook (Gunicorn).
+
+Thay cho `python app.py` (Werkzeug dev server) khi deploy ngoài Vercel:
+
+    python serve.py                          # thread workers, bind 0.0.0.0:8000
+    python serve.py --worker-class gevent    # cần `pip install gevent`
+    python serve.py --workers 4 --bind 127.0.0.1:1000
+"""
+import argparse
+import multiprocessing
+import os
+
+# Tên ngắn -> worker class của Gunicorn
+WORKER_CLASSES = {
+    'thread': 'gthread',
+    'gevent': 'gevent',
+}
+
+DRAIN_TIMEOUT = 10  # seconds, thời gian tối đa chờ notification khi worker thoát
+
+
+def default_workers(worker_class):
+    """Số worker mặc định theo số CPU core"""
+    cores = multiprocessing.cpu_count()
+    if worker_class == 'gevent':
+        # Mỗi worker gevent tự multiplex hàng nghìn kết nối: 1 worker/core, thêm 1 dự phòng
+        # khi có worker đang block (CPU-bound, restart theo max_requests)
+        return cores + 1
+    # Công thức khuyến nghị của Gunicorn cho worker sync/thread
+    return cores * 2 + 1
+
+
+def worker_exit(server, worker):
+    """Gunicorn hook: flush các Discord notification còn pending trước khi worker thoát"""
+    try:
+        from app import drain_pending
+        remaining = drain_pending(timeout=DRAIN_TIMEOUT)
+        if remaining:
+            server.log.warning("Worker %s exited with %s notification(s) still pending", worker.pid, remaining)
+    except Exception as e:
+        server.log.error("Drain failed in worker %s: %s", worker.pid, e)
+
+
+def build_options(args):
+    return {
+        'bind': args.bind,
+        'workers': args.workers or default_workers(args.worker_class),
+        'worker_class': WORKER_CLASSES[args.worker_class],
+        'threads': args.threads if args.worker_class == 'thread' else 1,
+        'worker_connections': args.worker_connections,
+        # Load app ở master trước khi fork: template/store cache (JSON) được chia sẻ copy-on-write.
+        # MongoClient không fork-safe nên khi dùng Mongo, mỗi worker tự import app (tự tạo client).
+        'preload_app': not os.environ.get('MONGO_URI'),
+        'keepalive': args.keepalive,
+        'timeout': args.timeout,
+        # Thời gian cho request đang xử lý + drain notification sau SIGTERM
+        'graceful_timeout': args.graceful_timeout,
+        # Recycle worker định kỳ để tránh memory phình dần
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests // 10 if args.max_requests else 0,
+        'accesslog': '-',
+        'errorlog': '-',
+        'worker_exit': worker_exit,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Yearbook production server (Gunicorn)')
+    parser.add_argument('--bind', default=f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+    parser.add_argument('--worker-class', choices=sorted(WORKER_CLASSES),
+                        default=os.environ.get('WORKER_CLASS', 'thread'))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_CONCURRENCY', 0)),
+                        help='Mặc định: tính theo số CPU core')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('THREADS', 4)),
+                        help='Số thread mỗi worker (chỉ với --worker-class thread)')
+    parser.add_argument('--worker-connections', type=int, default=1000,
+                        help='Số kết nối đồng thời mỗi worker (chỉ với --worker-class gevent)')
+    parser.add_argument('--keepalive', type=int, default=int(os.environ.get('KEEPALIVE', 5)),
+                        help='Giây giữ kết nối keep-alive (nên lớn hơn idle timeout của load balancer)')
+    parser.add_argument('--timeout', type=int, default=30)
+    parser.add_argument('--graceful-timeout', type=int, default=DRAIN_TIMEOUT + 20)
+    parser.add_argument('--max-requests', type=int, default=2000)
+    return parser.parse_args(argv)
+
+
+def run(options):
+    from gunicorn.app.base import BaseApplication
+
+    class YearbookServer(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                if key in self.cfg.settings and value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            from app import app
+            return app
+
+    YearbookServer(options).run()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.worker_class == 'gevent':
+        # Phải patch trước khi import app để pymongo/urllib dùng socket của gevent
+        from gevent import monkey
+        monkey.patch_all()
+    options = build_options(args)
+    print(f">> YEARBOOK PRODUCTION SERVER: {options['bind']} "
+          f"({options['workers']} x {args.worker_class} workers)")
+    run(options)